@@ -5,18 +5,326 @@ A script to extract the full content of Arabic books from ketabonline.com
 """
 
 import asyncio
+import atexit
+import contextlib
+import hashlib
+import heapq
+import json
 import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import os
+import random
+import time
 from pathlib import Path
-import aiohttp
+import httpx
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from tqdm import tqdm
-import time
+
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+# httpx can only decode brotli responses when a brotli package is installed
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# HTTP/2 lets all page requests share one connection; it needs the h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Encoding': ACCEPT_ENCODING,
+}
+
+# Patterns used for every page, compiled once
+_FOOTNOTE_MARK = re.compile(r'\d+-')
+_PAGINATION = re.compile(r'(\d+)\s*/\s*(\d+)')
+_PAGE_QS = re.compile(r'page=(\d+)')
+# Opening tag of the element whose class list contains page-nav
+_PAGE_NAV_TAG = re.compile(
+    r'<(\w+)\b[^>]*\bclass\s*=\s*["\'][^"\']*(?<![\w-])page-nav(?![\w-])[^"\']*["\'][^>]*>'
+)
+# How far past the page-nav opening tag the fast path looks for the counter
+_PAGE_NAV_WINDOW = 1000
+
+# Elements inside articles that are not part of the book text
+_SKIP_SELECTORS = ('.footnote', '.nav-btn', '.page-controls', 'script', 'style')
+_ARTICLE_UNWANTED = ', '.join(f'article {sel}' for sel in _SKIP_SELECTORS)
+
+# Marker line between pages in the saved book, and the encoded separator around it
+PAGE_MARKER = '==========='
+PAGE_SEP = f'\n\n{PAGE_MARKER}\n\n'.encode('utf-8')
+
+# Stop once this many pages in a row come back empty with nothing after them,
+# which means the page count overshot the end of the book
+EMPTY_PAGES_BEFORE_STOP = 3
+
+def _paragraphs_from_articles(tree):
+    """Extract cleaned paragraphs from the article elements"""
+    content = []
+    
+    # The main content is inside article elements nested in the generic container.
+    # Each step is a single query over the whole tree rather than one per article.
+    
+    # Remove unwanted elements. Matches come back grouped by selector, not in
+    # document order, so only decompose the outermost ones; a match nested in
+    # another match is freed along with it and must not be decomposed again.
+    unwanted = tree.css(_ARTICLE_UNWANTED)
+    matched = set(unwanted)
+    for el in unwanted:
+        parent = el.parent
+        while parent is not None and parent not in matched:
+            parent = parent.parent
+        if parent is None:
+            el.decompose()
+    
+    # Extract text from paragraphs
+    for paragraph in tree.css('article p'):
+        # Skip empty paragraphs and page numbers
+        text = paragraph.text(strip=True)
+        if not text or text.isdigit():
+            continue
+        
+        # Skip elements that only contain references; only short
+        # paragraphs can be that, so check the length first
+        if len(text) < 5 and paragraph.css_first('a[href^="#"]'):
+            continue
+        
+        # Clean the text - remove page numbers and footnote marks
+        content.append(_FOOTNOTE_MARK.sub('', text))
+    
+    return content
+
+
+def _paragraphs_from_content_blocks(tree):
+    """Extract paragraphs from any of the known content containers"""
+    content = []
+    
+    # Try to find article text in any visible paragraph element. The selector
+    # list returns a paragraph once per selector it matches, grouped by
+    # selector, so keep each matched paragraph once in document order.
+    matched = set(tree.css('article p, .article-content p, .page-content p'))
+    for paragraph in tree.css('p'):
+        if paragraph not in matched:
+            continue
+        text = paragraph.text(strip=True)
+        if text and not text.isdigit():
+            content.append(text)
+    
+    return content
+
+
+def _paragraphs_from_generic(tree):
+    """Extract paragraphs from the generic container"""
+    content = []
+    
+    # Look for content in the generic container where the book text is usually located
+    content_container = tree.css_first('.generic')
+    if content_container:
+        paragraphs = content_container.css('p')
+        for paragraph in paragraphs:
+            text = paragraph.text(strip=True)
+            if text and not text.isdigit():
+                content.append(text)
+    
+    return content
+
+
+# Extraction strategies, in the order they are tried
+_STRATEGIES = (
+    _paragraphs_from_articles,
+    _paragraphs_from_content_blocks,
+    _paragraphs_from_generic,
+)
+
+def extract_content_from_html(html):
+    """
+    Extract the book content from page HTML
+    
+    The strategies are always tried in priority order, so a page that falls
+    back to a looser selector never changes how later pages are read.
+    Kept at module level so it can be pickled and run in a worker process.
+    
+    Args:
+        html (str): The HTML content of the page
+        
+    Returns:
+        list: The extracted paragraphs, empty if none were found
+    """
+    if not html:
+        return []
+    
+    tree = LexborHTMLParser(html)
+    for extract in _STRATEGIES:
+        content = extract(tree)
+        if content:
+            return content
+    
+    return []
+
+
+# Process pool shared by all extractors, started on first use
+_PARSE_POOL = None
+
+def get_parse_pool():
+    """
+    Get the process pool pages are parsed in, starting it on first use
+    
+    The pool is kept until the interpreter exits, so extracting several
+    books only pays the worker start-up cost once.
+    
+    Returns:
+        ProcessPoolExecutor: The shared pool
+    """
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        _PARSE_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+        atexit.register(_PARSE_POOL.shutdown)
+    return _PARSE_POOL
+
+
+def reset_parse_pool(broken):
+    """
+    Replace the shared pool after one of its worker processes died
+    
+    A broken pool rejects every later task, so it is shut down and a new one
+    started. Extractors that hit the same broken pool all get the new one.
+    
+    Args:
+        broken (ProcessPoolExecutor): The pool that raised BrokenProcessPool
+        
+    Returns:
+        ProcessPoolExecutor: The working shared pool
+    """
+    global _PARSE_POOL
+    if _PARSE_POOL is broken:
+        broken.shutdown(wait=False, cancel_futures=True)
+        _PARSE_POOL = None
+    return get_parse_pool()
+
+
+def create_client(concurrency=10, headers=HEADERS):
+    """
+    Create an HTTP client for fetching book pages
+    
+    Pass one client to several extractors to reuse its connections, DNS
+    lookups and TLS sessions across books. With HTTP/2 all page requests are
+    multiplexed over a single connection. The caller closes the client.
+    
+    Args:
+        concurrency (int): Maximum number of open connections
+        headers (dict): Headers sent with every request
+        
+    Returns:
+        httpx.AsyncClient: The new client
+    """
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+        keepalive_expiry=75,
+    )
+    return httpx.AsyncClient(
+        headers=headers,
+        http2=HTTP2,
+        limits=limits,
+        follow_redirects=True,
+    )
+
+
+def page_digest(paragraphs):
+    """
+    Get a short fingerprint of a page's content, to spot repeated pages
+    
+    Args:
+        paragraphs (list): The page's extracted paragraphs
+        
+    Returns:
+        bytes: 8-byte BLAKE2b digest
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for paragraph in paragraphs:
+        digest.update(paragraph.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.digest()
+
+
+class RateLimiter:
+    """Token bucket capping how many requests start per second"""
+    
+    def __init__(self, rate):
+        """
+        Initialize the limiter with a full bucket
+        
+        Args:
+            rate (float): Requests allowed per second, also the burst size
+                (at least one request, so rates below 1 still get a token)
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.slowed_until = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may start, then take a token for it"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def slow_down(self, retry_after=0, factor=0.5, minimum=1.0):
+        """
+        Lower the rate after the server signals it is being overloaded
+        
+        Requests already in flight all see the same overload, so the rate is
+        lowered at most once per Retry-After window (at least one second).
+        
+        Args:
+            retry_after (float): Seconds the server asked to wait, 0 if unknown
+            factor (float): Multiplier applied to the current rate
+            minimum (float): Rate never goes below this many requests per second
+                (or the starting rate, if that is lower)
+        """
+        now = time.monotonic()
+        if now < self.slowed_until:
+            return
+        self.slowed_until = now + max(retry_after, 1.0)
+        self.rate = max(min(minimum, self.max_rate), self.rate * factor)
+    
+    def speed_up(self, step=0.1):
+        """
+        Raise the rate a little after a successful request
+        
+        Args:
+            step (float): Requests per second added, up to the starting rate
+        """
+        if self.rate < self.max_rate and time.monotonic() >= self.slowed_until:
+            self.rate = min(self.max_rate, self.rate + step)
+
 
 class KetabOnlineExtractor:
     """Main class for extracting books from ketabonline.com"""
     
-    def __init__(self, book_id, book_name, max_retries=3, delay=0.1, concurrency=10):
+    def __init__(self, book_id, book_name, max_retries=3, delay=0.1, concurrency=10, rate_limit=10,
+                 cache_dir=None, client=None):
         """
         Initialize the extractor with book information
         
@@ -26,25 +334,99 @@ class KetabOnlineExtractor:
             max_retries (int): Maximum number of retry attempts for failed requests
             delay (float): Delay between requests to avoid rate limiting
             concurrency (int): Maximum number of concurrent requests
+            rate_limit (float): Maximum requests started per second, None for no limit
+            cache_dir (str): Directory for per-page checkpoints used to resume an
+                interrupted run (default: .cache/<book_id> next to the output file)
+            client (httpx.AsyncClient): Client shared with other extractors, see
+                create_client(); it is left open by close() (default: own client)
         """
         self.base_url = f"https://ketabonline.com/ar/books/{book_id}/read"
         self.book_id = book_id
         self.book_name = book_name
+        self.default_cache = cache_dir is None
+        if self.default_cache:
+            cache_dir = Path(self.get_output_filename()).parent / '.cache' / str(book_id)
+        self.cache_dir = Path(cache_dir)
         self.max_retries = max_retries
         self.delay = delay
         self.concurrency = concurrency
         self.semaphore = asyncio.Semaphore(concurrency)
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        }
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.headers = HEADERS
         self.total_pages = 0
+        self.page_count_guessed = False
+        self.failed_pages = []
+        self.client = client
+        self.owns_client = client is None
+        
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def get_client(self):
+        """
+        Get the HTTP client, creating one on first use if none was passed in
+        
+        The client is kept open across extract_book calls so connections
+        and TLS sessions are reused. To reuse them across books as well, pass
+        the same client to each extractor. Call close() (or use the extractor
+        as an async context manager) when done.
         
-    async def get_page(self, session, page_number, part=1):
+        Returns:
+            httpx.AsyncClient: The client
+        """
+        if self.client is None or self.client.is_closed:
+            self.client = create_client(self.concurrency, self.headers)
+            self.owns_client = True
+        return self.client
+    
+    async def close(self):
+        """Close the HTTP client if this extractor created it"""
+        if not self.owns_client:
+            return
+        if self.client is not None and not self.client.is_closed:
+            await self.client.aclose()
+        self.client = None
+    
+    def get_backoff(self, attempt):
+        """
+        Get how long to wait before retrying a failed request
+        
+        The wait doubles with every attempt and is randomized by +/-50% so
+        concurrent requests that failed together don't all retry together.
+        
+        Args:
+            attempt (int): The zero-based attempt that just failed
+            
+        Returns:
+            float: Seconds to wait
+        """
+        return self.delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+    
+    @staticmethod
+    def get_retry_after(response):
+        """
+        Get the wait requested by a response's Retry-After header
+        
+        Args:
+            response (httpx.Response): The rate-limited response
+            
+        Returns:
+            float: Seconds to wait, 0 if the header is missing or not in seconds
+        """
+        try:
+            return float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            return 0
+    
+    async def get_page(self, client, page_number, part=1):
         """
         Get the content of a specific page asynchronously
         
         Args:
-            session (aiohttp.ClientSession): The aiohttp session
+            client (httpx.AsyncClient): The httpx client
             page_number (int): The page number to extract
             part (int): The part number (default: 1)
             
@@ -53,59 +435,95 @@ class KetabOnlineExtractor:
         """
         url = f"{self.base_url}?part={part}&page={page_number}"
         
-        async with self.semaphore:  # Limit concurrency
-            for attempt in range(self.max_retries):
-                try:
-                    async with session.get(url, timeout=10) as response:
-                        if response.status == 200:
-                            return page_number, await response.text()
-                        
-                    print(f"Error {response.status} for page {page_number}. Retrying ({attempt+1}/{self.max_retries})...")
-                    await asyncio.sleep(self.delay * (attempt + 1))  # Exponential backoff
+        for attempt in range(self.max_retries):
+            try:
+                # Politeness caps on request rate and on requests in flight; HTTP/2
+                # would otherwise send every page at once. Backoff sleeps happen
+                # outside both.
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire()
+                async with self.semaphore:
+                    response = await client.get(url, timeout=10)
+                if response.status_code == 200:
+                    if self.rate_limiter:
+                        self.rate_limiter.speed_up()
+                    return page_number, response.text
+                
+                # Client errors other than timeouts and rate limiting won't
+                # succeed on retry (e.g. 404 past the last page)
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    print(f"Error {response.status_code} for page {page_number}. Not retrying.")
+                    return page_number, None
                     
-                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-                    print(f"Request error for page {page_number}: {e}. Retrying ({attempt+1}/{self.max_retries})...")
-                    await asyncio.sleep(self.delay * (attempt + 1))
-            
-            print(f"Failed to get page {page_number} after {self.max_retries} attempts.")
-            return page_number, None
+                print(f"Error {response.status_code} for page {page_number}. Retrying ({attempt+1}/{self.max_retries})...")
+                delay = self.get_backoff(attempt)
+                if response.status_code in (429, 503):
+                    # Rate limited or overloaded: wait at least as long as the server asks
+                    retry_after = self.get_retry_after(response)
+                    delay = max(delay, retry_after)
+                    if self.rate_limiter:
+                        self.rate_limiter.slow_down(retry_after)
+                await asyncio.sleep(delay)
+                
+            except httpx.HTTPError as e:
+                print(f"Request error for page {page_number}: {e}. Retrying ({attempt+1}/{self.max_retries})...")
+                await asyncio.sleep(self.get_backoff(attempt))
+        
+        print(f"Failed to get page {page_number} after {self.max_retries} attempts.")
+        return page_number, None
     
-    async def get_total_pages(self, session):
+    async def get_total_pages(self, client):
         """
         Get the total number of pages in the book asynchronously
         
         Returns:
             int: Total number of pages
         """
-        _, html = await self.get_page(session, 1)
+        _, html = await self.get_page(client, 1)
         if not html:
             raise Exception("Cannot retrieve first page to determine total pages")
+        return self.get_total_pages_from_html(html)
+    
+    def get_total_pages_from_html(self, html):
+        """
+        Get the total number of pages in the book from the first page's HTML
+        
+        Args:
+            html (str): The HTML content of the first page
+            
+        Returns:
+            int: Total number of pages
+        """
+        self.page_count_guessed = False
+        
+        # Fast path: read the "N / M" counter straight from the raw HTML of the
+        # page-nav element, avoiding a full parse of the first page. The search
+        # stops at the first closing tag of the same name (or a short window),
+        # so CSS rules, dates and other text further down can't match.
+        nav_tag = _PAGE_NAV_TAG.search(html)
+        if nav_tag:
+            start = nav_tag.end()
+            end = html.find(f'</{nav_tag.group(1)}', start, start + _PAGE_NAV_WINDOW)
+            if end == -1:
+                end = start + _PAGE_NAV_WINDOW
+            match = _PAGINATION.search(html, start, end)
+            if match:
+                return int(match.group(2))
             
         try:
             # Look for pagination information showing total pages
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Try first with pagination info selector
-            pagination_text = None
-            page_nav = soup.select_one('.page-nav')
-            if page_nav:
-                pagination_div = page_nav.select_one('div:contains("/")')
-                if pagination_div:
-                    pagination_text = pagination_div.text.strip()
-            
-            if not pagination_text:
-                # Try with direct text search
-                for div in soup.select('div'):
-                    if '/' in div.text:
-                        match = re.search(r'(\d+)\s*/\s*(\d+)', div.text)
-                        if match:
-                            pagination_text = div.text
-                            break
+            soup = BeautifulSoup(html, PARSER)
             
-            if pagination_text:
-                match = re.search(r'(\d+)\s*/\s*(\d+)', pagination_text)
-                if match:
-                    return int(match.group(2))
+            # Try the pagination info container first, then each outermost div.
+            # Nested divs are covered by their outermost ancestor, so every text
+            # node is scanned once rather than once per enclosing div.
+            scopes = [soup.select_one('.page-nav')]
+            scopes += [div for div in soup.find_all('div') if div.find_parent('div') is None]
+            for scope in scopes:
+                if scope is not None:
+                    match = _PAGINATION.search(scope.get_text())
+                    if match:
+                        return int(match.group(2))
         
         except Exception as e:
             print(f"Error determining total pages: {e}")
@@ -118,7 +536,7 @@ class KetabOnlineExtractor:
                 page_numbers = []
                 for item in toc_items:
                     href = item.get('href', '')
-                    page_match = re.search(r'page=(\d+)', href)
+                    page_match = _PAGE_QS.search(href)
                     if page_match:
                         page_numbers.append(int(page_match.group(1)))
                 
@@ -129,6 +547,7 @@ class KetabOnlineExtractor:
             print(f"Error determining total pages from TOC: {e}")
         
         # Last resort: Check for a specific value we know about
+        self.page_count_guessed = True
         return 560  # Known number of pages for this book
     
     def extract_content_from_html(self, html):
@@ -139,113 +558,300 @@ class KetabOnlineExtractor:
             html (str): The HTML content of the page
             
         Returns:
-            str: The extracted text content
+            list: The extracted paragraphs, empty if none were found
         """
-        if not html:
-            return ""
+        return extract_content_from_html(html)
+    
+    @staticmethod
+    def save_page_to_cache(cache_path, paragraphs):
+        """
+        Checkpoint a page's extracted paragraphs so a later run can skip it
+        
+        The file is written under a temporary name and then renamed, so an
+        interrupted write never leaves a truncated checkpoint behind.
+        
+        Args:
+            cache_path (Path): The page's checkpoint file
+            paragraphs (list): The page's extracted paragraphs
+        """
+        tmp_path = cache_path.with_suffix('.tmp')
+        tmp_path.write_text("\n\n".join(paragraphs), encoding='utf-8')
+        os.replace(tmp_path, cache_path)
+    
+    def cache_files(self):
+        """
+        Get the checkpoint files in the cache directory
+        
+        Returns:
+            list: Paths of the page checkpoint files
+        """
+        return [
+            path for path in self.cache_dir.glob('page_*.txt')
+            if path.stem[len('page_'):].isdigit()
+        ]
+    
+    def prepare_cache(self):
+        """
+        Make sure the cache directory only holds checkpoints of this book
+        
+        A manifest records which book and page count the checkpoints belong
+        to. If it is missing or doesn't match, the old checkpoints are removed
+        rather than mixed into this book.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.cache_dir / 'manifest.json'
+        manifest = {'book_id': str(self.book_id), 'total_pages': self.total_pages}
+        try:
+            if json.loads(manifest_path.read_text(encoding='utf-8')) == manifest:
+                return
+        except (OSError, ValueError):
+            pass
+        
+        for path in self.cache_files():
+            path.unlink()
+        manifest_path.write_text(json.dumps(manifest), encoding='utf-8')
+    
+    def clear_cache(self):
+        """
+        Remove this book's checkpoints once the book is complete
+        
+        Only the checkpoint files and manifest are deleted; the directory
+        itself (and the default .cache parent) is removed only if nothing
+        else is left in it.
+        """
+        for path in self.cache_files():
+            path.unlink(missing_ok=True)
+        (self.cache_dir / 'manifest.json').unlink(missing_ok=True)
+        dirs = [self.cache_dir]
+        if self.default_cache:
+            dirs.append(self.cache_dir.parent)
+        try:
+            for directory in dirs:
+                directory.rmdir()
+        except OSError:
+            pass
+    
+    async def _page_worker(self, client, queue, done, pool, pbar, prefetched):
+        """
+        Download and parse pages from the queue until it is empty
+        
+        Args:
+            client (httpx.AsyncClient): The httpx client
+            queue (asyncio.Queue): Page numbers still to fetch
+            done (asyncio.Queue): Receives (page_number, paragraphs) for every page,
+                paragraphs being None if the page failed
+            pool (ProcessPoolExecutor): Pool the pages are parsed in
+            pbar (tqdm): Progress bar to advance per page
+            prefetched (dict): HTML already downloaded, by page number
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                page_num = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
             
-        soup = BeautifulSoup(html, 'html.parser')
-        content = []
+            paragraphs = None
+            try:
+                html = prefetched.pop(page_num, None)
+                cache_path = self.cache_dir / f"page_{page_num:05d}.txt"
+                if cache_path.exists():
+                    # Extracted by an earlier, interrupted run
+                    paragraphs = cache_path.read_text(encoding='utf-8').split("\n\n")
+                else:
+                    if html is None:
+                        _, html = await self.get_page(client, page_num)
+                    if html:
+                        try:
+                            paragraphs = await loop.run_in_executor(pool, extract_content_from_html, html)
+                        except BrokenProcessPool:
+                            # A parse process died (e.g. killed for memory); start
+                            # a new pool and parse the page again
+                            pool = reset_parse_pool(pool)
+                            paragraphs = await loop.run_in_executor(pool, extract_content_from_html, html)
+                        if paragraphs:
+                            self.save_page_to_cache(cache_path, paragraphs)
+                    else:
+                        print(f"Warning: No HTML content for page {page_num}")
+            except Exception as e:
+                print(f"Error processing page {page_num}: {e}")
+            
+            # Always report the page so the consumer never waits on it forever
+            done.put_nowait((page_num, paragraphs))
+            pbar.update(1)
+    
+    async def iter_pages(self):
+        """
+        Download and extract every page of the book, yielding them in order
         
-        # The main content is inside article elements nested in the generic container
-        articles = soup.select('article')
+        Pages are fetched concurrently; those that finish early are held in a
+        min-heap until every page before them has been yielded, so only the
+        out-of-order window is kept in memory. When the page count is only a
+        guess, extraction ends early once several pages in a row are empty and
+        none of the pages requested so far has content after them, so a wrong
+        count doesn't mean fetching hundreds of missing pages.
         
-        if articles:
-            for article in articles:
-                # Remove unwanted elements
-                for el in article.select('.footnote, .nav-btn, .page-controls, script, style'):
-                    el.decompose()
-                
-                # Extract text from paragraphs
-                paragraphs = article.select('p')
-                for paragraph in paragraphs:
-                    # Skip elements that only contain references
-                    if paragraph.select_one('a[href^="#"]') and len(paragraph.get_text(strip=True)) < 5:
-                        continue
-                        
-                    # Skip page numbers
-                    text = paragraph.get_text(strip=True)
-                    if text and not re.match(r'^\d+$', text):
-                        # Clean the text - remove page numbers and footnote marks
-                        text = re.sub(r'\d+-', '', text)
-                        content.append(text)
-        
-        # If no content was found with the above method, try more generic selectors
-        if not content:
-            # Try to find article text in any visible paragraph element
-            paragraphs = soup.select('article p, .article-content p, .page-content p')
-            for paragraph in paragraphs:
-                text = paragraph.get_text(strip=True)
-                if text and not re.match(r'^\d+$', text):
-                    content.append(text)
-        
-        # If still no content, try directly selecting elements that are likely to contain the content
-        if not content:
-            # Look for content in the generic container where the book text is usually located
-            content_container = soup.select_one('.generic')
-            if content_container:
-                paragraphs = content_container.select('p')
-                for paragraph in paragraphs:
-                    text = paragraph.get_text(strip=True)
-                    if text and not re.match(r'^\d+$', text):
-                        content.append(text)
+        Yields:
+            tuple: (page_number, paragraphs), paragraphs being None if the page
+                failed or repeats the previous page
+        """
+        client = self.get_client()
         
-        return "\n\n".join(content) if content else ""
+        # The first page gives the page count and is kept for extraction,
+        # so it is only downloaded once
+        _, first_html = await self.get_page(client, 1)
+        if not first_html:
+            raise Exception("Cannot retrieve first page to determine total pages")
+        self.total_pages = self.get_total_pages_from_html(first_html)
+        prefetched = {1: first_html}
+        print(f"Book has {self.total_pages} pages.")
+        
+        # Pages checkpointed here by an interrupted run are not fetched again
+        self.prepare_cache()
+        self.failed_pages = []
+        
+        # Queue page numbers for a fixed pool of workers instead of
+        # creating a coroutine per page upfront
+        queue = asyncio.Queue()
+        for page in range(1, self.total_pages + 1):
+            queue.put_nowait(page)
+        done = asyncio.Queue()
+        
+        # Parse in worker processes so downloads keep flowing meanwhile
+        pool = get_parse_pool()
+        with tqdm(total=self.total_pages, desc="Downloading pages") as pbar:
+            workers = [
+                asyncio.create_task(self._page_worker(client, queue, done, pool, pbar, prefetched))
+                for _ in range(min(self.concurrency, self.total_pages))
+            ]
+            try:
+                pending = []
+                next_expected = 1
+                empty_run = 0
+                last_digest = None
+                last_content_page = 0
+                stop_after = None
+                stopped = False
+                while not stopped and next_expected <= self.total_pages:
+                    page_num, paragraphs = await done.get()
+                    if paragraphs is None:
+                        self.failed_pages.append(page_num)
+                    digest = page_digest(paragraphs) if paragraphs else None
+                    heapq.heappush(pending, (page_num, digest, paragraphs))
+                    
+                    while pending and pending[0][0] == next_expected:
+                        page_num, digest, paragraphs = heapq.heappop(pending)
+                        if paragraphs:
+                            if digest == last_digest:
+                                # Same content as the previous page, which is what the
+                                # site serves for page numbers past the end of the book
+                                paragraphs = None
+                            else:
+                                last_digest = digest
+                                last_content_page = page_num
+                        
+                        empty_run = 0 if paragraphs else empty_run + 1
+                        yield page_num, paragraphs
+                        next_expected += 1
+                        
+                        # A real page count is trusted; empty pages inside the
+                        # book (e.g. image-only ones) must not end it early
+                        if not self.page_count_guessed:
+                            continue
+                        # Later pages that arrived early only count as content if
+                        # they aren't yet another copy of the last real page
+                        has_more = any(
+                            digest is not None and digest != last_digest
+                            for _, digest, _ in pending
+                        )
+                        if empty_run < EMPTY_PAGES_BEFORE_STOP or has_more:
+                            stop_after = None
+                            continue
+                        # Pages still in flight may have content, so only stop
+                        # once every page requested by now has come back empty
+                        if stop_after is None:
+                            stop_after = self.total_pages - queue.qsize()
+                        if next_expected > stop_after:
+                            print(f"Stopping after page {next_expected - 1}: last {empty_run} pages were empty or repeated.")
+                            stopped = True
+                            break
+                
+                # With a guessed count the pages after the last one with content
+                # are past the end of the book (usually 404s), not lost pages
+                if self.page_count_guessed:
+                    self.failed_pages = [
+                        page for page in self.failed_pages if page < last_content_page
+                    ]
+            finally:
+                for worker in workers:
+                    worker.cancel()
     
     async def extract_book(self):
         """
         Extract the complete book content asynchronously
         
+        The book is built directly as UTF-8 bytes, one page at a time, so no
+        intermediate list of page strings or joined str is held alongside it.
+        
         Returns:
-            str: The complete book content
+            bytearray: The complete book content, UTF-8 encoded
         """
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                self.total_pages = await self.get_total_pages(session)
-                print(f"Book has {self.total_pages} pages.")
-                
-                # Create tasks for all pages
-                tasks = [self.get_page(session, page) for page in range(1, self.total_pages + 1)]
-                
-                # Initialize content list with None placeholders
-                results = [None] * self.total_pages
-                
-                with tqdm(total=self.total_pages, desc="Downloading pages") as pbar:
-                    # Process completed tasks as they come in
-                    for future in asyncio.as_completed(tasks):
-                        page_num, html = await future
-                        if html:
-                            content = self.extract_content_from_html(html)
-                            results[page_num - 1] = content
-                        else:
-                            print(f"Warning: No HTML content for page {page_num}")
-                        pbar.update(1)
-                
-                # Filter out any None values and join content
-                valid_results = [r for r in results if r]
-                return "\n\n===========\n\n".join(valid_results)
-                
+            # Skip any failed or empty pages
+            buf = bytearray()
+            async with contextlib.aclosing(self.iter_pages()) as pages:
+                async for _, paragraphs in pages:
+                    if not paragraphs:
+                        continue
+                    if buf:
+                        buf += PAGE_SEP
+                    buf += "\n\n".join(paragraphs).encode('utf-8')
+            
+            # Keep the checkpoints if any page failed, so a re-run can resume
+            if not self.failed_pages:
+                self.clear_cache()
+            return buf
+            
         except Exception as e:
             print(f"Error extracting book: {e}")
             return None
+    
+    def get_output_filename(self):
+        """
+        Get the name of the file the book is saved to
+        
+        Returns:
+            str: The output filename
+        """
+        return f"{self.book_name.replace(' ', '_')}.txt"
             
     def save_to_file(self, content):
         """
         Save the extracted content to a file
         
         Args:
-            content (str): The content to save
+            content (str or bytes): The content to save, bytes being UTF-8 encoded
             
         Returns:
             bool: True if successful, False otherwise
         """
         if not content:
             return False
+        if isinstance(content, str):
+            content = content.encode('utf-8')
             
-        filename = f"{self.book_name.replace(' ', '_')}.txt"
+        filename = self.get_output_filename()
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(content)
+            # Write the encoded bytes straight to the file descriptor in 1 MiB
+            # chunks, skipping the text layer's buffering and newline handling
+            data = memoryview(content)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+            fd = os.open(filename, flags, 0o644)
+            try:
+                while data:
+                    data = data[os.write(fd, data[:1 << 20]):]
+            finally:
+                os.close(fd)
             print(f"Book saved to {filename}")
             return True
         except Exception as e:
@@ -256,13 +862,53 @@ class KetabOnlineExtractor:
         """
         Extract the book content and save it to a file
         
+        Pages are written as soon as they are next in order, rather than
+        holding the whole book in memory first.
+        
         Returns:
             bool: True if successful, False otherwise
         """
-        content = await self.extract_book()
-        if content:
-            return self.save_to_file(content)
-        return False
+        filename = self.get_output_filename()
+        # Stream into a side file and only replace the real one once the book
+        # is complete, so a failed re-run never destroys a good earlier copy
+        part_filename = filename + '.part'
+        written = False
+        try:
+            # Binary mode, like save_to_file, so both produce identical files.
+            # A 1 MiB buffer batches the many small page writes into few syscalls.
+            # aclosing() stops the page workers if writing fails part way.
+            with open(part_filename, 'wb', buffering=1 << 20) as f:
+                async with contextlib.aclosing(self.iter_pages()) as pages:
+                    async for _, paragraphs in pages:
+                        if not paragraphs:
+                            continue
+                        if written:
+                            f.write(PAGE_SEP)
+                        f.write("\n\n".join(paragraphs).encode('utf-8'))
+                        written = True
+            
+            if written:
+                os.replace(part_filename, filename)
+                    
+        except Exception as e:
+            print(f"Error extracting book: {e}")
+            written = False
+        
+        if not written:
+            # Don't leave an empty or partial file behind
+            if os.path.exists(part_filename):
+                os.remove(part_filename)
+            return False
+        
+        # The book is complete, so its page checkpoints are no longer needed,
+        # unless a page failed and a re-run should resume from them
+        if self.failed_pages:
+            print(f"{len(self.failed_pages)} pages failed; keeping checkpoints in {self.cache_dir}")
+        else:
+            self.clear_cache()
+        
+        print(f"Book saved to {filename}")
+        return True
 
 
 # Main execution
@@ -275,8 +921,8 @@ async def main():
     concurrency = 15  # Number of concurrent requests
     
     print(f"Extracting book: صيد الخاطر (ID: {book_id}) with {concurrency} concurrent connections")
-    extractor = KetabOnlineExtractor(book_id, book_name, concurrency=concurrency)
-    await extractor.extract_and_save()
+    async with KetabOnlineExtractor(book_id, book_name, concurrency=concurrency) as extractor:
+        await extractor.extract_and_save()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file